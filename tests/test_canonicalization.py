@@ -1,9 +1,14 @@
 from tucan.canonicalization import (
+    OrderedPartition,
     canonicalize_molecule,
+    get_automorphism_generators,
+    get_partitions_from_attribute,
+    get_canonical_molecule,
+    get_refinement_tree_levels,
     partition_molecule_by_attribute,
     refine_partitions,
 )
-from tucan.graph_attributes import ATOMIC_NUMBER, PARTITION
+from tucan.graph_attributes import ATOMIC_NUMBER, INVARIANT_CODE, PARTITION
 from tucan.serialization import serialize_molecule
 from tucan.graph_utils import permute_molecule
 from tucan.test_utils import permutation_invariance
@@ -53,6 +58,89 @@ def test_refine_partitions(m):
     )
 
 
+def test_ordered_partition_undo():
+    # Cyclic graph with six nodes.
+    neighbors = [((i - 1) % 6, (i + 1) % 6) for i in range(6)]
+    partition = OrderedPartition([0] * 6, neighbors)
+    mark = partition.mark()
+
+    partition.individualize(0)
+    assert partition.partitions == [3, 2, 1, 0, 1, 2]
+    assert partition.n_partitions == 4
+
+    partition.individualize(1)
+    assert partition.is_discrete()
+
+    partition.undo(mark)
+    assert partition.partitions == [0] * 6
+    assert partition.n_partitions == 1
+
+
+def test_ordered_partition_matches_full_refinement(m):
+    def refine(partitions):
+        while True:
+            refined = get_partitions_from_attribute(partitions, neighbors)
+            if refined == partitions:
+                return list(partitions.values())
+            partitions = refined
+
+    m = nx.convert_node_labels_to_integers(m)
+    neighbors = {node: tuple(m[node]) for node in m}
+    partitions = refine(
+        dict(enumerate(nx.get_node_attributes(m, ATOMIC_NUMBER).values()))
+    )
+    partition = OrderedPartition(partitions, list(neighbors.values()))
+    partition.refine()
+    assert partition.partitions == partitions
+
+    # Individualize the first node of the largest partition until discrete.
+    while not partition.is_discrete():
+        node = max(range(len(partitions)), key=partitions.count)
+        partition.individualize(node)
+        partitions[node] = max(partitions) + 1
+        partitions = refine(dict(enumerate(partitions)))
+        assert partition.partitions == partitions
+
+
+def test_canonicalize_molecule_matches_refinement_tree_levels(m):
+    m_partitioned = partition_molecule_by_attribute(m, INVARIANT_CODE)
+    m_refined = list(refine_partitions(m_partitioned))[-1]
+    leaves = list(get_refinement_tree_levels(m_refined))[-1]
+
+    assert serialize_molecule(canonicalize_molecule(m)) == serialize_molecule(
+        get_canonical_molecule(leaves)
+    )
+
+
+def test_automorphism_generators(m):
+    edges = {frozenset(edge) for edge in m.edges}
+    for automorphism in get_automorphism_generators(m):
+        assert all(
+            m.nodes[node][INVARIANT_CODE] == m.nodes[image][INVARIANT_CODE]
+            for node, image in automorphism.items()
+        )
+        assert {frozenset(automorphism[n] for n in edge) for edge in edges} == edges
+
+
+@pytest.mark.parametrize(
+    "m, expected_orbit_sizes",
+    [
+        ("methane", [1, 4]),
+        ("benzene", [6, 6]),
+        ("cubane", [8, 8]),
+        ("C60", [60]),
+    ],
+)
+def test_automorphism_orbits(m, expected_orbit_sizes):
+    m = graph_from_file(f"tests/molfiles/{m}/{m}.mol")
+    orbits = nx.Graph()
+    orbits.add_nodes_from(m)
+    for automorphism in get_automorphism_generators(m):
+        orbits.add_edges_from(automorphism.items())
+
+    assert sorted(map(len, nx.connected_components(orbits))) == expected_orbit_sizes
+
+
 def test_permutation(m):
     # Enforce permutation for graphs with at least 2 edges that aren't fully connected (i.e., complete).
     if m.number_of_edges() <= 1:
@@ -0,0 +1,23 @@
+from tucan.canonicalization import canonicalize_molecule
+from tucan.compact_molecule import (
+    compact_molecule_from_graph,
+    graph_from_compact_molecule,
+)
+from tucan.serialization import serialize_molecule
+
+
+def test_roundtrip_graph_compact_graph(m):
+    m_roundtrip = graph_from_compact_molecule(compact_molecule_from_graph(m))
+
+    assert list(m_roundtrip.nodes(data=True)) == list(m.nodes(data=True))
+    assert sorted(
+        (*sorted(e[:2]), e[2]) for e in m_roundtrip.edges(data=True)
+    ) == sorted((*sorted(e[:2]), e[2]) for e in m.edges(data=True))
+
+
+def test_compact_molecule_serialization_matches_graph(m):
+    m_serialized = serialize_molecule(canonicalize_molecule(m))
+    c_canonical = canonicalize_molecule(compact_molecule_from_graph(m))
+
+    assert serialize_molecule(c_canonical) == m_serialized
+    assert serialize_molecule(graph_from_compact_molecule(c_canonical)) == m_serialized
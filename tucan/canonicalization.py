@@ -1,7 +1,13 @@
+from array import array
+from tucan.compact_molecule import (
+    CompactMolecule,
+    compact_molecule_from_graph,
+    permute_compact_molecule,
+)
 from tucan.graph_attributes import PARTITION, INVARIANT_CODE
 from tucan.graph_utils import get_attribute_sequences
 import networkx as nx
-from typing import Generator, Any
+from typing import Generator, Any, NamedTuple, Sequence
 from collections import Counter
 
 
@@ -51,35 +57,30 @@ def _refine_partitions(
     partitions: list[int],
     node_neighbors: list[tuple[int, list[int]]],
 ) -> tuple[list[int], int]:
-    neighbors = {node: tuple(neighbors) for node, neighbors in node_neighbors}
-    nodes = tuple(neighbors.keys())
+    neighbors: list[tuple[int, ...]] = [()] * len(partitions)
+    for node, node_neighbors_ in node_neighbors:
+        neighbors[node] = tuple(node_neighbors_)
+    partition = OrderedPartition(partitions, neighbors)
+    partition.refine()
 
-    _partitions = partitions
-    while True:
-        attributes = {node: _partitions[node] for node in nodes}
-        seqs = get_attribute_sequences(attributes, neighbors)
-        unique_seqs = sorted(set(seqs))
-        seqs_to_partitions = {
-            seq: partition for partition, seq in enumerate(unique_seqs)
-        }
-        _partitions_refined = [seqs_to_partitions[seq] for seq in seqs]
-        if _partitions_refined == _partitions:
-            return _partitions, len(unique_seqs)
-
-        _partitions = _partitions_refined
+    return partition.partitions, partition.n_partitions
 
 
 def refine_partitions(m: nx.Graph) -> Generator[nx.Graph, None, None]:
-    partitions = {node: m._node[node][PARTITION] for node in m}
-    neighbors = {node: tuple(m[node]) for node in m}
-
-    while True:
-        yield set_partitions(m, partitions)
-        refined = get_partitions_from_attribute(partitions, neighbors)
-        if refined == partitions:
-            return
-
-        partitions = refined
+    nodes = list(m)
+    node_indices = {node: i for i, node in enumerate(nodes)}
+    partitions = [m._node[node][PARTITION] for node in nodes]
+    neighbors = [
+        tuple(node_indices[neighbor] for neighbor in m[node]) for node in nodes
+    ]
+
+    yield set_partitions(m, dict(zip(nodes, partitions)))
+    partition = OrderedPartition(partitions, neighbors)
+    if (ranks := partition.partitions) != partitions:
+        # Partitions weren't zero-based and contiguous.
+        yield set_partitions(m, dict(zip(nodes, ranks)))
+    for _ in partition.refine_rounds():
+        yield set_partitions(m, dict(zip(nodes, partition.partitions)))
 
 
 def get_target_partition(m: nx.Graph) -> int:
@@ -197,9 +198,525 @@ def get_canonical_molecule(ms: list[nx.Graph]) -> nx.Graph:
     return m_canonical
 
 
-def canonicalize_molecule(m: nx.Graph) -> nx.Graph:
-    m_partitioned_by_invariant_code = partition_molecule_by_attribute(m, INVARIANT_CODE)
-    m_refined = list(refine_partitions(m_partitioned_by_invariant_code))[-1]
-    ms_discrete_partitionings = list(get_refinement_tree_levels(m_refined))[-1]
+def canonicalize_molecule(m: nx.Graph | CompactMolecule) -> nx.Graph | CompactMolecule:
+    """Canonicalize a molecule.
+
+    NetworkX graphs are canonicalized on a `CompactMolecule` view and returned as a
+    relabeled copy of `m`. `CompactMolecule` inputs are canonicalized natively and
+    returned as a `CompactMolecule` whose nodes are in canonical order.
+    """
+    labels = _search_refinement_tree(m).canonical_labels
+    if isinstance(m, CompactMolecule):
+        m_canonical = permute_compact_molecule(m, labels)
+
+        return m_canonical._replace(partitions=array("i", range(len(labels))))
+
+    m_canonical = nx.relabel_nodes(m, dict(zip(m, labels, strict=True)), copy=True)
+    for node, attrs in m_canonical.nodes(data=True):
+        attrs[PARTITION] = node
+    m_canonical.graph["n_partitions"] = len(labels)
+
+    return m_canonical
+
+
+def get_automorphism_generators(
+    m: nx.Graph | CompactMolecule,
+) -> list[dict[Any, Any]] | list[array]:
+    """Generators of the automorphism group of a molecule.
+
+    The generators are a by-product of `canonicalize_molecule`. They're returned as
+    mappings from node to image for NetworkX graphs, and as permutation arrays for
+    `CompactMolecule` inputs. Automorphisms preserve the invariant code of the
+    nodes. Only automorphisms that are encountered during the refinement tree
+    search are recorded, hence the generators may not span the full group.
+    """
+    automorphisms = _search_refinement_tree(m).automorphisms
+    if isinstance(m, CompactMolecule):
+        return automorphisms
+
+    nodes = list(m)
+
+    return [
+        {node: nodes[image] for node, image in zip(nodes, automorphism, strict=True)}
+        for automorphism in automorphisms
+    ]
+
+
+class _SearchResult(NamedTuple):
+    canonical_labels: list[int]
+    automorphisms: list[array]
+
+
+def _search_refinement_tree(m: nx.Graph | CompactMolecule) -> _SearchResult:
+    """Canonical label of each node of `m`, and automorphisms of `m`.
+
+    Runs the same algorithm as `canonicalize_molecule` did on NetworkX graphs, but
+    traverses the refinement tree depth-first on a single `OrderedPartition`
+    instead of building it level by level from graph copies. Nodes are indexed in
+    the iteration order of `m`.
+    """
+    if isinstance(m, CompactMolecule):
+        c = m
+        invariant_codes = list(zip(c.atomic_numbers, c.masses, c.rads))
+    else:
+        c = compact_molecule_from_graph(m)
+        invariant_codes = [attrs[INVARIANT_CODE] for attrs in c.node_attrs]  # type: ignore
+    neighbors = [tuple(c.neighbors(node)) for node in range(c.number_of_nodes())]
+    edges = list(c.edges())
+    partition = OrderedPartition(
+        _partition_by_attribute(invariant_codes, neighbors), neighbors
+    )
+    partition.refine()
+    search = _RefinementTreeSearch(partition, edges)
+    search.run()
+
+    return _SearchResult(
+        _get_canonical_partitions(search.leaves, edges), search.automorphisms
+    )
+
+
+def _get_partition_sequences(
+    partitions: Sequence[Any], neighbors: list[tuple[int, ...]]
+) -> list[tuple[Any, ...]]:
+    return [
+        (partitions[node], *sorted([partitions[neighbor] for neighbor in nbrs]))
+        for node, nbrs in enumerate(neighbors)
+    ]
+
+
+def _partition_by_attribute(
+    attributes: Sequence[Any], neighbors: list[tuple[int, ...]]
+) -> list[int]:
+    """Equivalent of `partition_molecule_by_attribute`."""
+    seqs = _get_partition_sequences(attributes, neighbors)
+    seqs_to_partitions = {
+        seq: partition for partition, seq in enumerate(sorted(set(seqs)))
+    }
+
+    return [seqs_to_partitions[seq] for seq in seqs]
+
+
+class OrderedPartition:
+    """Partitioning of the nodes of a graph that is refined in-place.
+
+    `partitions[node]` is the zero-based partition of `node`. Refinement gives the
+    same partitions as `refine_partitions`: in each round, the nodes of a partition
+    are split by the sorted partitions of their neighbors, and the resulting
+    partitions are ordered by these sequences. Unlike `refine_partitions`, only
+    partitions with a neighbor of a node that changed partition in the previous
+    round are re-examined.
+
+    Internally, a partition is identified by a key that is the index of its first
+    node when all nodes are ordered by partition. Splitting a partition therefore
+    leaves the keys of all other partitions, and of the first part of the split
+    partition, unchanged. Individualized nodes are keyed from `n` upwards.
+
+    Every change is recorded on a trail, such that the partitioning can be
+    restored to an earlier state with `undo(mark)`, where `mark` has been obtained
+    from `mark()`.
+    """
+
+    def __init__(self, partitions: list[int], neighbors: list[tuple[int, ...]]):
+        self.neighbors = neighbors
+        nodes_by_partition: dict[int, list[int]] = {}
+        for node, partition in enumerate(partitions):
+            nodes_by_partition.setdefault(partition, []).append(node)
+        self._keys = [0] * len(partitions)
+        self._cells: dict[int, list[int]] = {}  # key -> nodes
+        key = 0
+        for partition in sorted(nodes_by_partition):
+            nodes = nodes_by_partition[partition]
+            for node in nodes:
+                self._keys[node] = key
+            self._cells[key] = nodes
+            key += len(nodes)
+        self._n_individualized = 0
+        self._keys_trail: list[tuple[int, int]] = []  # (node, previous key)
+        # (key, previous nodes), where `None` indicates that the key didn't exist.
+        self._cells_trail: list[tuple[int, list[int] | None]] = []
+
+    @property
+    def partitions(self) -> list[int]:
+        partitions_by_key = {key: p for p, key in enumerate(sorted(self._cells))}
+
+        return [partitions_by_key[key] for key in self._keys]
+
+    @property
+    def n_partitions(self) -> int:
+        return len(self._cells)
+
+    def is_discrete(self) -> bool:
+        return len(self._cells) == len(self._keys)
+
+    def mark(self) -> tuple[int, int, int]:
+        return len(self._keys_trail), len(self._cells_trail), self._n_individualized
+
+    def undo(self, mark: tuple[int, int, int]) -> None:
+        keys_trail_length, cells_trail_length, self._n_individualized = mark
+        keys, keys_trail = self._keys, self._keys_trail
+        while len(keys_trail) > keys_trail_length:
+            node, key = keys_trail.pop()
+            keys[node] = key
+        cells, cells_trail = self._cells, self._cells_trail
+        while len(cells_trail) > cells_trail_length:
+            key, nodes = cells_trail.pop()
+            if nodes is None:
+                del cells[key]
+            else:
+                cells[key] = nodes
+
+    def individualize(self, node: int) -> None:
+        """Move `node` into a new partition after all others and refine."""
+        key = self._keys[node]
+        nodes = [n for n in self._cells[key] if n != node]
+        self._set_cell(key, nodes if nodes else None)
+        individualized_key = len(self._keys) + self._n_individualized
+        self._n_individualized += 1
+        self._set_cell(individualized_key, [node])
+        self._keys_trail.append((node, key))
+        self._keys[node] = individualized_key
+
+        for _ in self.refine_rounds({self._keys[n] for n in self.neighbors[node]}):
+            pass
+
+    def refine(self) -> None:
+        for _ in self.refine_rounds():
+            pass
+
+    def refine_rounds(
+        self, keys_to_examine: set[int] | None = None
+    ) -> Generator[None, None, None]:
+        """Refine until no partition is split, yielding after every round.
+
+        By default, all partitions are examined in the first round.
+        """
+        keys, cells, neighbors = self._keys, self._cells, self.neighbors
+        if keys_to_examine is None:
+            keys_to_examine = set(cells)
+
+        while keys_to_examine:
+            splits = []
+            for key in keys_to_examine:
+                nodes = cells[key]
+                if len(nodes) == 1:
+                    continue
+                nodes_by_seq: dict[tuple[int, ...], list[int]] = {}
+                for node in nodes:
+                    seq = tuple(
+                        sorted([keys[neighbor] for neighbor in neighbors[node]])
+                    )
+                    nodes_by_seq.setdefault(seq, []).append(node)
+                if len(nodes_by_seq) > 1:
+                    splits.append((key, nodes_by_seq))
+            if not splits:
+                return
+
+            changed_nodes = []
+            for key, nodes_by_seq in splits:
+                for part, seq in enumerate(sorted(nodes_by_seq)):
+                    nodes = nodes_by_seq[seq]
+                    self._set_cell(key, nodes)
+                    if part:
+                        for node in nodes:
+                            self._keys_trail.append((node, keys[node]))
+                            keys[node] = key
+                        changed_nodes.extend(nodes)
+                    key += len(nodes)
+
+            keys_to_examine = {
+                keys[neighbor] for node in changed_nodes for neighbor in neighbors[node]
+            }
+            yield
+
+    def _set_cell(self, key: int, nodes: list[int] | None) -> None:
+        self._cells_trail.append((key, self._cells.get(key)))
+        if nodes is None:
+            del self._cells[key]
+        else:
+            self._cells[key] = nodes
+
+
+def _get_target_partition(partitions: list[int]) -> int:
+    partition_sizes = Counter(sorted(partitions))
+
+    return max(partition_sizes, key=partition_sizes.get)  # type: ignore
+
+
+def _get_labeling(
+    partitions: Sequence[int], edges: list[tuple[int, int]]
+) -> tuple[tuple[int, int], ...]:
+    labeling = []
+    for u, v in edges:
+        pu, pv = partitions[u], partitions[v]
+        labeling.append((pu, pv) if pu <= pv else (pv, pu))
+    labeling.sort()
+
+    return tuple(labeling)
+
+
+class _RefinementTreeNode:
+    def __init__(
+        self, mark: tuple[int, int, int], children: list[int], fixed: list[int]
+    ):
+        self.mark = mark
+        self.children = children  # nodes left to individualize, in reverse order
+        self.fixed = fixed  # nodes individualized on the path from the root
+        self.visited: list[int] = []  # individualized children
+        # Labelings of visited children, and their partitions.
+        self.labelings: dict[tuple[tuple[int, int], ...], array] = {}
+        # Orbits of the automorphisms that fix `fixed` (union-find forest).
+        self.orbits: list[int] | None = None
+        self.n_automorphisms = 0  # automorphisms merged into `orbits`
+
+
+class _RefinementTreeSearch:
+    """Depth-first traversal of the refinement tree.
+
+    Only the path from the root to the current node is kept in memory; `partition`
+    is refined in-place and restored from its trail when backtracking. Like
+    `filter_out_automorphisms`, children of a node whose labeling equals that of a
+    visited sibling are skipped. Such a child is probed along its first children
+    for a leaf that is automorphic to a known leaf.
+
+    Two discrete leaves with identical labelings yield an automorphism of the
+    molecule. Children that lie in the same orbit as a visited sibling under the
+    automorphisms that fix the path to their parent root isomorphic subtrees and
+    are skipped.
+    """
+
+    def __init__(self, partition: OrderedPartition, edges: list[tuple[int, int]]):
+        self.partition = partition
+        self.edges = edges
+        self.leaves: list[tuple[int, array]] = []  # (depth, partitions)
+        self.automorphisms: list[array] = []
+        self._root_partitions = array("i", partition.partitions)
+        self._edge_set = set(edges)
+        self._supports: list[list[int]] = []  # nodes moved by each automorphism
+        self._is_probing = True
+        self._leaves_by_labeling: dict[int, list[int]] = {}
+
+    def run(self) -> None:
+        partition = self.partition
+        partitions = partition.partitions
+        if partition.is_discrete():
+            self.leaves.append((0, array("i", partitions)))
+            return
+
+        path = [self._expand([], partitions)]
+        while path:
+            tree_node = path[-1]
+            partition.undo(tree_node.mark)
+            if not tree_node.children:
+                path.pop()
+                continue
+
+            node = tree_node.children.pop()
+            if self._is_in_visited_orbit(tree_node, node):
+                continue
+            tree_node.visited.append(node)
+
+            partition.individualize(node)
+            partitions = partition.partitions
+            labeling = _get_labeling(partitions, self.edges)
+            if partition.is_discrete():
+                self._add_leaf(len(path), array("i", partitions), labeling)
+                continue
+            if (sibling_partitions := tree_node.labelings.get(labeling)) is not None:
+                if not self._match_sibling(partitions, sibling_partitions):
+                    if self._is_probing:
+                        self._probe(len(path))
+                continue
+            tree_node.labelings[labeling] = array("i", partitions)
+
+            path.append(self._expand(tree_node.fixed + [node], partitions))
+
+    def _expand(self, fixed: list[int], partitions: list[int]) -> _RefinementTreeNode:
+        target_partition = _get_target_partition(partitions)
+        children = [node for node, p in enumerate(partitions) if p == target_partition]
+        children.reverse()
+
+        return _RefinementTreeNode(self.partition.mark(), children, fixed)
+
+    def _add_leaf(
+        self, depth: int, partitions: array, labeling: tuple[tuple[int, int], ...]
+    ) -> None:
+        if not self._find_automorphisms(depth, partitions, labeling):
+            self._leaves_by_labeling.setdefault(hash(labeling), []).append(
+                len(self.leaves)
+            )
+            self.leaves.append((depth, partitions))
+
+    def _match_sibling(self, partitions: list[int], sibling_partitions: array) -> bool:
+        """Search for an automorphism between the current node and a sibling.
+
+        The nodes of each partition are mapped onto the nodes of the same partition
+        of the sibling, in order of their labels. This catches local symmetries,
+        e.g., the permutation of hydrogen atoms in a methyl group, without
+        descending to a leaf.
+        """
+        n = len(partitions)
+        sibling_nodes_by_partition: list[list[int]] = [[] for _ in range(n + 1)]
+        for node, partition in enumerate(sibling_partitions):
+            sibling_nodes_by_partition[partition].append(node)
+
+        automorphism = array("i", range(n))
+        cursors = [0] * (n + 1)
+        for node, partition in enumerate(partitions):
+            sibling_nodes = sibling_nodes_by_partition[partition]
+            if cursors[partition] == len(sibling_nodes):
+                return False  # partition sizes differ
+            automorphism[node] = sibling_nodes[cursors[partition]]
+            cursors[partition] += 1
+
+        if not self._is_automorphism(automorphism):
+            return False
+        self._add_automorphism(automorphism)
+
+        return True
+
+    def _probe(self, depth: int) -> None:
+        """Descend along the first children to a leaf and search for automorphisms.
+
+        The leaf isn't added to `leaves`, hence the result of the search is not
+        affected. If no automorphism is found, siblings with identical labelings
+        aren't necessarily automorphic for this molecule (e.g., for CFI graphs),
+        and probing is turned off.
+        """
+        partition = self.partition
+        partitions = partition.partitions
+        while not partition.is_discrete():
+            target_partition = _get_target_partition(partitions)
+            partition.individualize(partitions.index(target_partition))
+            partitions = partition.partitions
+            depth += 1
+        labeling = _get_labeling(partitions, self.edges)
+        n_automorphisms = len(self.automorphisms)
+        self._find_automorphisms(depth, array("i", partitions), labeling)
+        self._is_probing = len(self.automorphisms) > n_automorphisms
+
+    def _find_automorphisms(
+        self, depth: int, partitions: array, labeling: tuple[tuple[int, int], ...]
+    ) -> bool:
+        """Record automorphisms between the leaf `partitions` and known leaves.
+
+        Returns whether an automorphic leaf has been found at the same depth.
+        """
+        has_automorphic_leaf = False
+        for leaf_index in self._leaves_by_labeling.get(hash(labeling), []):
+            leaf_depth, leaf_partitions = self.leaves[leaf_index]
+            if _get_labeling(leaf_partitions, self.edges) != labeling:
+                continue  # hash collision
+            automorphism = self._get_automorphism(leaf_partitions, partitions)
+            if automorphism is None:
+                continue
+            if automorphism not in self.automorphisms:
+                self._add_automorphism(automorphism)
+            if leaf_depth == depth:
+                has_automorphic_leaf = True
+                break
+
+        return has_automorphic_leaf
+
+    def _get_automorphism(self, partitions: array, other: array) -> array | None:
+        """Permutation that maps the leaf `other` onto the leaf `partitions`.
+
+        Both leaves must have identical labelings. Returns `None` if the permutation
+        is the identity or does not preserve the partitions at the root, i.e., the
+        invariant codes.
+        """
+        nodes_by_partition = array("i", partitions)
+        for node, partition in enumerate(partitions):
+            nodes_by_partition[partition] = node
+        automorphism = array("i", [nodes_by_partition[p] for p in other])
+
+        root_partitions = self._root_partitions
+        if any(
+            root_partitions[node] != root_partitions[image]
+            for node, image in enumerate(automorphism)
+        ):
+            return None
+        if all(node == image for node, image in enumerate(automorphism)):
+            return None
+
+        return automorphism
+
+    def _add_automorphism(self, automorphism: array) -> None:
+        self.automorphisms.append(automorphism)
+        self._supports.append(
+            [node for node, image in enumerate(automorphism) if node != image]
+        )
+
+    def _is_automorphism(self, permutation: array) -> bool:
+        """Whether `permutation` preserves the edges and root partitions."""
+        if len(set(permutation)) != len(permutation):
+            return False
+        if all(node == image for node, image in enumerate(permutation)):
+            return False
+        root_partitions = self._root_partitions
+        if any(
+            root_partitions[node] != root_partitions[image]
+            for node, image in enumerate(permutation)
+        ):
+            return False
+        edges = self._edge_set
+        for u, v in self.edges:
+            pu, pv = permutation[u], permutation[v]
+            if ((pu, pv) if pu < pv else (pv, pu)) not in edges:
+                return False
+
+        return True
+
+    def _is_in_visited_orbit(self, tree_node: _RefinementTreeNode, node: int) -> bool:
+        automorphisms = self.automorphisms
+        for i in range(tree_node.n_automorphisms, len(automorphisms)):
+            automorphism = automorphisms[i]
+            if any(automorphism[fixed] != fixed for fixed in tree_node.fixed):
+                continue
+            if tree_node.orbits is None:
+                tree_node.orbits = list(range(len(automorphism)))
+            for moved_node in self._supports[i]:
+                _union(tree_node.orbits, moved_node, automorphism[moved_node])
+        tree_node.n_automorphisms = len(automorphisms)
+
+        if (orbits := tree_node.orbits) is None:
+            return False
+        orbit = _find(orbits, node)
+
+        return any(_find(orbits, visited) == orbit for visited in tree_node.visited)
+
+
+def _find(parents: list[int], node: int) -> int:
+    while (parent := parents[node]) != node:
+        parents[node] = parents[parent]  # path halving
+        node = parent
+
+    return node
+
+
+def _union(parents: list[int], node: int, other: int) -> None:
+    root, other_root = _find(parents, node), _find(parents, other)
+    if root != other_root:
+        parents[max(root, other_root)] = min(root, other_root)
+
+
+def _get_canonical_partitions(
+    leaves: list[tuple[int, array]], edges: list[tuple[int, int]]
+) -> list[int]:
+    # In the level-wise formulation of the refinement tree (see
+    # `get_refinement_tree_levels`), a discrete node above the last level has a
+    # single child per remaining level: node 0 is individualized, which shifts all
+    # partitions down by one (cyclically). Replicate this to retain the labels.
+    max_depth = max(depth for depth, _ in leaves)
+    canonical_partitions: list[int] = []
+    canonical_labeling = None
+
+    for depth, partitions in leaves:
+        n = len(partitions)
+        shift = max_depth - depth
+        shifted_partitions = [(p - shift) % n for p in partitions]
+        labeling = _get_labeling(shifted_partitions, edges)
+        if canonical_labeling is None or labeling > canonical_labeling:
+            canonical_partitions = shifted_partitions
+            canonical_labeling = labeling
 
-    return get_canonical_molecule(ms_discrete_partitionings)
+    return canonical_partitions
@@ -0,0 +1,160 @@
+from __future__ import annotations
+from array import array
+import networkx as nx
+from typing import Any, Iterator, NamedTuple
+
+from tucan.element_attributes import element_symbols
+from tucan.graph_attributes import (
+    ATOMIC_NUMBER,
+    ELEMENT_SYMBOL,
+    MASS,
+    PARTITION,
+    RAD,
+)
+
+
+class CompactMolecule(NamedTuple):
+    """Molecular graph stored in flat integer arrays.
+
+    The adjacency is stored in compressed sparse row (CSR) format: the neighbors of
+    node `i` are `indices[indptr[i]:indptr[i + 1]]`. The remaining arrays are
+    indexed by node. A mass or radical of 0 means that the attribute is not set.
+
+    `node_attrs` and `edge_attrs` optionally hold references to the attribute
+    dictionaries of the NetworkX graph the molecule was created from. They are
+    shared, not copied, and only needed to restore the full graph.
+    """
+
+    indptr: array
+    indices: array
+    atomic_numbers: array
+    masses: array
+    rads: array
+    partitions: array
+    node_attrs: tuple[dict[str, Any], ...] | None = None
+    edge_attrs: dict[tuple[int, int], dict[str, Any]] | None = None
+
+    def number_of_nodes(self) -> int:
+        return len(self.atomic_numbers)
+
+    def number_of_edges(self) -> int:
+        return len(self.indices) // 2
+
+    def neighbors(self, node: int) -> array:
+        return self.indices[self.indptr[node] : self.indptr[node + 1]]
+
+    def edges(self) -> Iterator[tuple[int, int]]:
+        """Iterate over edges `(u, v)` with `u < v`."""
+        indptr, indices = self.indptr, self.indices
+        for u in range(len(indptr) - 1):
+            for v in indices[indptr[u] : indptr[u + 1]]:
+                if u < v:
+                    yield u, v
+
+    def element_symbol(self, node: int) -> str:
+        return element_symbols[self.atomic_numbers[node] - 1]
+
+
+def compact_molecule_from_graph(m: nx.Graph) -> CompactMolecule:
+    """Convert a NetworkX graph to a `CompactMolecule`.
+
+    Nodes are indexed in the iteration order of `m`. Attribute dictionaries are
+    shared with `m`.
+    """
+    index = {node: i for i, node in enumerate(m)}
+    node_data = m._node
+    adjacency = m._adj
+
+    indptr = array("i", [0])
+    indices = array("i")
+    for node in m:
+        indices.extend(sorted(index[neighbor] for neighbor in adjacency[node]))
+        indptr.append(len(indices))
+
+    node_attrs = tuple(node_data[node] for node in m)
+
+    return CompactMolecule(
+        indptr=indptr,
+        indices=indices,
+        atomic_numbers=array("i", [attrs[ATOMIC_NUMBER] for attrs in node_attrs]),
+        masses=array("i", [attrs.get(MASS, 0) for attrs in node_attrs]),
+        rads=array("i", [attrs.get(RAD, 0) for attrs in node_attrs]),
+        partitions=array("i", [attrs.get(PARTITION, 0) for attrs in node_attrs]),
+        node_attrs=node_attrs,
+        edge_attrs={
+            _edge(index[u], index[v]): attrs for u, v, attrs in m.edges(data=True)
+        },
+    )
+
+
+def graph_from_compact_molecule(c: CompactMolecule) -> nx.Graph:
+    """Convert a `CompactMolecule` to a NetworkX graph with nodes `0..n-1`.
+
+    If `c` was created from a NetworkX graph, the attribute values of the original
+    graph are re-used (not copied).
+    """
+    graph = nx.Graph()
+    node_attrs = c.node_attrs
+    for node in range(c.number_of_nodes()):
+        attrs = dict(node_attrs[node]) if node_attrs is not None else {}
+        if node_attrs is None:
+            attrs[ELEMENT_SYMBOL] = c.element_symbol(node)
+            attrs[ATOMIC_NUMBER] = c.atomic_numbers[node]
+            if mass := c.masses[node]:
+                attrs[MASS] = mass
+            if rad := c.rads[node]:
+                attrs[RAD] = rad
+        attrs[PARTITION] = c.partitions[node]
+        graph._node[node] = attrs
+        graph._adj[node] = {}
+
+    edge_attrs = c.edge_attrs
+    for u, v in c.edges():
+        attrs = edge_attrs.get((u, v), {}) if edge_attrs is not None else {}
+        graph._adj[u][v] = attrs
+        graph._adj[v][u] = attrs
+    graph.graph["n_partitions"] = len(set(c.partitions))
+
+    return graph
+
+
+def permute_compact_molecule(
+    c: CompactMolecule, labels: list[int] | array
+) -> CompactMolecule:
+    """Relabel the nodes of `c`, such that node `i` becomes node `labels[i]`."""
+    n = c.number_of_nodes()
+    order = [0] * n  # order[new label] = old label
+    for old, new in enumerate(labels):
+        order[new] = old
+
+    indptr = array("i", [0])
+    indices = array("i")
+    for old in order:
+        indices.extend(sorted(labels[neighbor] for neighbor in c.neighbors(old)))
+        indptr.append(len(indices))
+
+    return CompactMolecule(
+        indptr=indptr,
+        indices=indices,
+        atomic_numbers=array("i", [c.atomic_numbers[old] for old in order]),
+        masses=array("i", [c.masses[old] for old in order]),
+        rads=array("i", [c.rads[old] for old in order]),
+        partitions=array("i", [c.partitions[old] for old in order]),
+        node_attrs=(
+            tuple(c.node_attrs[old] for old in order)
+            if c.node_attrs is not None
+            else None
+        ),
+        edge_attrs=(
+            {
+                _edge(labels[u], labels[v]): attrs
+                for (u, v), attrs in c.edge_attrs.items()
+            }
+            if c.edge_attrs is not None
+            else None
+        ),
+    )
+
+
+def _edge(u: int, v: int) -> tuple[int, int]:
+    return (u, v) if u < v else (v, u)
@@ -6,14 +6,18 @@ from tucan.graph_attributes import (
     MASS,
     RAD,
 )
+from tucan.compact_molecule import CompactMolecule
 from tucan.graph_utils import sort_molecule_by_attribute
 import tucan
-from typing import Final
+from typing import Any, Final, Iterable
 import networkx as nx
 
 
-def serialize_molecule(m: nx.Graph) -> str:
+def serialize_molecule(m: nx.Graph | CompactMolecule) -> str:
     """Serialize a molecule."""
+    if isinstance(m, CompactMolecule):
+        return _serialize_compact_molecule(m)
+
     m_sorted = sort_molecule_by_attribute(m, ATOMIC_NUMBER)
     serialization = f"TUCANv{tucan.__version__}/"
     serialization += _write_sum_formula(m_sorted)
@@ -24,8 +28,49 @@ def serialize_molecule(m: nx.Graph) -> str:
     return serialization
 
 
+def _serialize_compact_molecule(c: CompactMolecule) -> str:
+    """Serialize a `CompactMolecule` without converting it to a NetworkX graph.
+
+    Equivalent to `sort_molecule_by_attribute(m, ATOMIC_NUMBER)` followed by the
+    `_write_*` functions.
+    """
+    atomic_numbers = c.atomic_numbers
+    n = c.number_of_nodes()
+    attr_seqs = [
+        (
+            atomic_numbers[node],
+            *sorted([atomic_numbers[neighbor] for neighbor in c.neighbors(node)]),
+        )
+        for node in range(n)
+    ]
+    labels = [0] * n
+    for label, node in enumerate(sorted(range(n), key=lambda i: (attr_seqs[i], i))):
+        labels[node] = label
+
+    serialization = f"TUCANv{tucan.__version__}/"
+    serialization += _format_sum_formula(
+        Counter(c.element_symbol(node) for node in range(n))
+    )
+    serialization += "/" + _format_edge_list(
+        sorted(sorted((labels[u], labels[v])) for u, v in c.edges())
+    )
+    node_attrs = {
+        labels[node]: {MASS: c.masses[node], RAD: c.rads[node]} for node in range(n)
+    }
+    node_attributes = _format_node_attributes(
+        (label, {key: value for key, value in attrs.items() if value})
+        for label, attrs in sorted(node_attrs.items())
+    )
+    serialization += f"/{node_attributes}" if node_attributes else ""
+
+    return serialization
+
+
 def _write_edge_list(m: nx.Graph) -> str:
-    sorted_edges = sorted([sorted(edge) for edge in m.edges()])
+    return _format_edge_list(sorted([sorted(edge) for edge in m.edges()]))
+
+
+def _format_edge_list(sorted_edges: list[list[int]]) -> str:
     edge_list_string = "".join(
         [f"({edge[0] + 1}-{edge[1] + 1})" for edge in sorted_edges]
     )
@@ -40,8 +85,14 @@ _SERIALIZER_NODE_ATTRIBUTE_MAPPING: Final[dict[str, str]] = {
 
 
 def _write_node_attributes(m: nx.Graph) -> str:
+    return _format_node_attributes(sorted(m.nodes(data=True)))
+
+
+def _format_node_attributes(
+    sorted_nodes: Iterable[tuple[int, dict[str, Any]]],
+) -> str:
     node_attribute_string = ""
-    for label, attrs in sorted(m.nodes(data=True)):
+    for label, attrs in sorted_nodes:
         available_attrs = [
             f"{_SERIALIZER_NODE_ATTRIBUTE_MAPPING[attr]}={attrs[attr]}"
             for attr in _SERIALIZER_NODE_ATTRIBUTE_MAPPING
@@ -68,7 +119,12 @@ def _write_sum_formula(m: nx.Graph) -> str:
     ----------
     [1] doi:10.1021/ja02046a005
     """
-    element_counts = Counter(nx.get_node_attributes(m, ELEMENT_SYMBOL).values())
+    return _format_sum_formula(
+        Counter(nx.get_node_attributes(m, ELEMENT_SYMBOL).values())
+    )
+
+
+def _format_sum_formula(element_counts: Counter) -> str:
     sum_formula_string = ""
     carbon_count = element_counts.pop("C", None)
     if carbon_count: